@@ -0,0 +1,143 @@
+"""
+Shared helpers for the BPMN schema test scripts
+"""
+
+import functools
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMBINED_SCHEMA = "schemas/bpmn-combined.json"
+
+# Source schemas merged into COMBINED_SCHEMA
+SCHEMA_FILES = (
+    "schemas/bpmn-common.json",
+    "schemas/bpmn-flow-objects.json",
+    "schemas/bpmn-connectors.json",
+    "schemas/bpmn-artifacts.json",
+    "schemas/bpmn-agents.json",
+    "schemas/bpmn-process.json",
+)
+
+# BPMN documents exercised by the test scripts; invalid-bpmn.json is
+# expected to fail
+TEST_FILES = (
+    "test-data/simple-process.json",
+    "test-data/parallel-gateway.json",
+    "test-data/exclusive-gateway.json",
+    "test-data/subprocess.json",
+    "test-data/ai-human-collab.json",
+    "test-data/dynamic-assignment.json",
+    "test-data/invalid-bpmn.json",
+)
+
+# Use orjson when it is installed; otherwise the stdlib parser is fast
+# enough for files of this size
+loads = orjson.loads if orjson is not None else json.loads
+
+def load_json(filepath):
+    """Read and parse a JSON file"""
+    with open(filepath, 'rb') as f:
+        return loads(f.read())
+
+def dump_json(obj, filepath, compact=False):
+    """Write obj as JSON with a trailing newline, indented unless compact
+    is set"""
+    if orjson is not None:
+        option = 0 if compact else orjson.OPT_INDENT_2
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(obj, option=option) + b"\n")
+    else:
+        with open(filepath, 'w') as f:
+            if compact:
+                json.dump(obj, f, separators=(',', ':'))
+            else:
+                json.dump(obj, f, indent=2)
+            f.write("\n")
+
+# Matches definition refs, either external ("bpmn-common.json#/definitions/
+# Documentation") or local to the schema they appear in ("#/definitions/task")
+_REF_RE = re.compile(r"^(?:bpmn-([a-z-]+)\.json)?#/definitions/([^#]+)$")
+
+@functools.lru_cache(maxsize=None)
+def _rewrite_ref(value, schema_name):
+    """Point a $ref found in bpmn-<schema_name>.json at the combined definitions"""
+    m = _REF_RE.match(value)
+    if not m:
+        return value
+    source_schema, def_name = m.groups()
+    # Local refs resolve against the schema they were written in
+    source_schema = source_schema or schema_name
+    if source_schema == "process":
+        return f"#/definitions/{def_name}"
+    # Keep the hyphenated schema name so refs match the merged definition keys
+    return f"#/definitions/{source_schema}_{def_name}"
+
+def _load_schema(filepath):
+    """Load a schema file, returning its name, parsed contents and whether
+    its source text contains any $ref"""
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    return Path(filepath).stem, loads(raw), b'"$ref"' in raw
+
+def build_combined_schema(schema_files):
+    """Load the BPMN schemas and merge them into one self-contained schema"""
+    
+    # Read and parse the files concurrently; map() keeps the input order
+    with ThreadPoolExecutor(max_workers=len(schema_files)) as executor:
+        loaded = list(executor.map(_load_schema, schema_files))
+    schemas = {name: schema for name, schema, _ in loaded}
+    
+    # Update all $ref to use combined definitions, rewriting each tree in place
+    def update_refs(obj, schema_name):
+        stack = [obj]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    if key == "$ref" and isinstance(value, str):
+                        node[key] = _rewrite_ref(value, schema_name)
+                    elif isinstance(value, (dict, list)):
+                        stack.append(value)
+            elif isinstance(node, list):
+                stack.extend(node)
+    
+    for name, schema, has_refs in loaded:
+        # Schemas with no $ref in their source text have nothing to rewrite
+        if has_refs:
+            update_refs(schema, name.replace('bpmn-', ''))
+    
+    # Start with the process schema as base; it is not used again, so it is
+    # modified in place rather than copied
+    combined = schemas['bpmn-process']
+    
+    # Merge all definitions into a single definitions object
+    all_definitions = {}
+    
+    for name, schema in schemas.items():
+        definitions = schema.get('definitions')
+        if not definitions:
+            continue
+        if name == 'bpmn-process':
+            # Keep process definitions without prefix
+            all_definitions.update(definitions)
+        else:
+            # Prefix definitions with schema name to avoid conflicts
+            prefix = name.replace('bpmn-', '') + '_'
+            all_definitions.update(
+                (prefix + def_name, definition)
+                for def_name, definition in definitions.items()
+            )
+    
+    combined['definitions'] = all_definitions
+    
+    # Remove the $id to avoid conflicts
+    combined.pop('$id', None)
+    
+    return combined
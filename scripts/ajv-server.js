@@ -0,0 +1,48 @@
+#!/usr/bin/env node
+/**
+ * Long-running AJV v8.17 validator for the combined BPMN schema
+ * Usage: node ajv-server.js [schema-file]
+ *
+ * Compiles the schema once, then reads data file paths from stdin (one per
+ * line) and writes one line per path to stdout: "OK" when the file is valid,
+ * otherwise a JSON array of validation errors.
+ */
+
+const fs = require("fs");
+const path = require("path");
+const readline = require("readline");
+
+// Load AJV from global installation
+const globalModulePath = "/usr/lib/node_modules";
+const Ajv = require(path.join(globalModulePath, "ajv"));
+
+const schemaFile = process.argv[2] || "schemas/bpmn-combined.json";
+
+// Create AJV instance with draft-07 support
+const ajv = new Ajv({ strict: false });
+
+// Try to load format validators if available
+try {
+  const addFormats = require(path.join(globalModulePath, "ajv-formats"));
+  addFormats(ajv);
+} catch (e) {
+  // ajv-formats not installed, formats will be ignored
+}
+
+const validate = ajv.compile(JSON.parse(fs.readFileSync(schemaFile, "utf8")));
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+
+rl.on("line", (dataFile) => {
+  if (!dataFile) {
+    return;
+  }
+  let errors;
+  try {
+    const data = JSON.parse(fs.readFileSync(dataFile, "utf8"));
+    errors = validate(data) ? null : validate.errors;
+  } catch (err) {
+    errors = [{ instancePath: "", message: err.message }];
+  }
+  process.stdout.write(errors ? JSON.stringify(errors) + "\n" : "OK\n");
+});
@@ -3,112 +3,108 @@
 Combine BPMN schemas into a single file for validation testing
 """
 
-import json
+import argparse
+import hashlib
+import subprocess
+import threading
 from pathlib import Path
 
-def combine_schemas():
-    """Combine all BPMN schemas into a single schema file"""
-    
-    # Load all BPMN schemas
-    schemas = {}
-    schema_files = [
-        "schemas/bpmn-common.json",
-        "schemas/bpmn-flow-objects.json",
-        "schemas/bpmn-connectors.json",
-        "schemas/bpmn-artifacts.json",
-        "schemas/bpmn-agents.json",
-        "schemas/bpmn-process.json"
-    ]
-    
-    for filepath in schema_files:
-        with open(filepath, 'r') as f:
-            schema = json.load(f)
-            name = Path(filepath).stem
-            schemas[name] = schema
-    
-    # Start with the process schema as base
-    combined = schemas['bpmn-process'].copy()
-    
-    # Merge all definitions into a single definitions object
-    all_definitions = {}
-    
-    for name, schema in schemas.items():
-        if 'definitions' in schema:
-            # Prefix definitions with schema name to avoid conflicts
-            for def_name, definition in schema['definitions'].items():
-                if name == 'bpmn-process':
-                    # Keep process definitions without prefix
-                    all_definitions[def_name] = definition
-                else:
-                    # Add prefix for other schemas
-                    prefix = name.replace('bpmn-', '') + '_'
-                    all_definitions[prefix + def_name] = definition
-    
-    combined['definitions'] = all_definitions
-    
-    # Update all $ref to use local definitions
-    def update_refs(obj, schema_name):
-        if isinstance(obj, dict):
-            new_obj = {}
-            for key, value in obj.items():
-                if key == "$ref" and isinstance(value, str):
-                    # Convert external ref to local ref
-                    if value.startswith("bpmn-"):
-                        parts = value.split("#/definitions/")
-                        if len(parts) == 2:
-                            source_schema = parts[0].replace(".json", "")
-                            def_name = parts[1]
-                            if source_schema == "bpmn-process":
-                                new_obj[key] = f"#/definitions/{def_name}"
-                            else:
-                                prefix = source_schema.replace('bpmn-', '') + '_'
-                                new_obj[key] = f"#/definitions/{prefix}{def_name}"
-                        else:
-                            new_obj[key] = value
-                    else:
-                        new_obj[key] = value
-                else:
-                    new_obj[key] = update_refs(value, schema_name)
-            return new_obj
-        elif isinstance(obj, list):
-            return [update_refs(item, schema_name) for item in obj]
-        else:
-            return obj
-    
-    # Update all references in the combined schema
-    combined = update_refs(combined, 'bpmn-process')
-    
-    # Remove the $id to avoid conflicts
-    if '$id' in combined:
-        del combined['$id']
+import _bpmn_common
+from _bpmn_common import (
+    COMBINED_SCHEMA, SCHEMA_FILES, TEST_FILES, build_combined_schema, dump_json, loads
+)
+
+COMBINED_HASH = "schemas/.bpmn-combined.hash"
+
+def _schema_digest(schema_files, compact):
+    """Hash the source schemas, the code that builds and serializes them and
+    the output format to detect stale output"""
+    h = hashlib.blake2b()
+    for filepath in [*schema_files, __file__, _bpmn_common.__file__]:
+        h.update(Path(filepath).read_bytes())
+    h.update(b"compact" if compact else b"indented")
+    return h.hexdigest()
+
+def _output_digest():
+    """Hash the combined schema currently on disk"""
+    return hashlib.blake2b(Path(COMBINED_SCHEMA).read_bytes()).hexdigest()
+
+def _combined_is_current(digest):
+    """Check that the inputs match the recorded digest and that the combined
+    schema on disk is the file that was written for them"""
+    try:
+        recorded = Path(COMBINED_HASH).read_text().split()
+        return recorded == [digest, _output_digest()]
+    except FileNotFoundError:
+        return False
+
+def combine_schemas(compact=False):
+    """Combine all BPMN schemas into a single schema file
     
-    # Save the combined schema
-    with open('schemas/bpmn-combined.json', 'w') as f:
-        json.dump(combined, f, indent=2)
+    The file is indented like the committed copy unless compact is set.
+    """
     
-    print("Created combined schema: schemas/bpmn-combined.json")
+    # Skip regeneration when neither the sources nor the build code changed and
+    # the combined schema has not been edited or replaced since it was written
+    digest = _schema_digest(SCHEMA_FILES, compact)
+    if _combined_is_current(digest):
+        print(f"Combined schema is up-to-date: {COMBINED_SCHEMA}")
+    else:
+        combined = build_combined_schema(SCHEMA_FILES)
+        
+        # Save the combined schema
+        dump_json(combined, COMBINED_SCHEMA, compact=compact)
+        Path(COMBINED_HASH).write_text(f"{digest}\n{_output_digest()}\n")
+        
+        print(f"Created combined schema: {COMBINED_SCHEMA}")
     
     # Test validation with the combined schema
     print("\nTesting validation with combined schema...")
-    test_files = [
-        "test-data/simple-process.json",
-        "test-data/parallel-gateway.json",
-        "test-data/exclusive-gateway.json"
-    ]
     
-    for test_file in test_files:
-        print(f"\nValidating {test_file}...")
-        import subprocess
-        result = subprocess.run(
-            ['ajv', 'validate', '-s', 'schemas/bpmn-combined.json', '-d', test_file],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            print(f"✓ {test_file} is valid")
-        else:
-            print(f"✗ {test_file} validation failed:")
-            print(result.stderr)
+    # Compile the combined schema once in a long-running node process. All
+    # paths are queued up front and each result is printed as soon as the
+    # server answers it, so validation and reporting overlap
+    with subprocess.Popen(
+        ['node', 'scripts/ajv-server.js', COMBINED_SCHEMA],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True
+    ) as server:
+        def feed():
+            try:
+                server.stdin.writelines(f"{test_file}\n" for test_file in TEST_FILES)
+                server.stdin.close()
+            except (BrokenPipeError, ValueError):
+                # The server exited early; reported below
+                pass
+        
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        
+        results = iter(server.stdout)
+        for test_file in TEST_FILES:
+            print(f"\nValidating {test_file}...", flush=True)
+            result = next(results, "").rstrip("\n")
+            
+            if result == "OK":
+                print(f"✓ {test_file} is valid")
+            elif not result:
+                print("✗ ajv server exited unexpectedly")
+                break
+            else:
+                print(f"✗ {test_file} validation failed:")
+                for i, error in enumerate(loads(result), 1):
+                    print(f"  {i}. {error.get('instancePath') or '/'}: {error['message']}")
+        
+        feeder.join()
 
 if __name__ == "__main__":
-    combine_schemas()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="write the combined schema without indentation; the committed "
+             "copy is indented, so this leaves it modified"
+    )
+    args = parser.parse_args()
+    combine_schemas(compact=args.compact)
\ No newline at end of file
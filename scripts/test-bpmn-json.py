@@ -1,121 +1,220 @@
 #!/usr/bin/env python3
 """
 Simple BPMN JSON structure validator
-Tests basic structure without full schema validation
+Tests basic structure, then validates structurally sound files against the
+combined schema when fastjsonschema is installed and the schema is current
+
+Each file is parsed once. Schema validation needs the whole document, so the
+low-memory ijson streaming path is only used for structure-only runs, i.e.
+when fastjsonschema is missing or the combined schema cannot be used.
 """
 
-import json
 import sys
 from pathlib import Path
 
-def check_bpmn_file(filepath):
-    """Check basic BPMN file structure"""
-    errors = []
+from _bpmn_common import (
+    COMBINED_SCHEMA, SCHEMA_FILES, TEST_FILES, build_combined_schema, load_json
+)
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    # Without ijson the whole document is loaded before checking
+    ijson = None
+
+try:
+    import fastjsonschema
+except ImportError:
+    # Without fastjsonschema only the structural checks run
+    fastjsonschema = None
+
+# Required fields for each element kind, with the label used in messages
+REQUIRED_FIELDS = {
+    'events': ('Event', ('id', 'type')),
+    'activities': ('Activity', ('id', 'name', 'type')),
+    'gateways': ('Gateway', ('id', 'type')),
+    'sequenceFlows': ('Sequence flow', ('id', 'sourceRef', 'targetRef')),
+}
+
+def _missing_fields(kind, item):
+    """Return an error for each required field the element is missing"""
+    label, required = REQUIRED_FIELDS[kind]
+    return [
+        f"{label} missing 'id': {item}" if field == 'id'
+        else f"{label} {item.get('id', '?')} missing '{field}'"
+        for field in required
+        if field not in item
+    ]
+
+def _document_elements(data, keys):
+    """Yield (kind, items) for each entry under process.elements of a
+    parsed document, recording its root-level and process-level keys"""
+    if not isinstance(data, dict):
+        return
+    keys.update(data)
+    process = data.get('process')
+    if isinstance(process, dict):
+        keys.update(f"process.{key}" for key in process)
+        elements = process.get('elements')
+        if isinstance(elements, dict):
+            # Match the streaming parser, which only yields element arrays
+            for kind, items in elements.items():
+                if isinstance(items, list):
+                    yield kind, items
+
+def _stream_elements(filepath, keys, load_errors):
+    """Yield (kind, items) for each array under process.elements
     
+    Root-level and process-level keys are recorded in keys as they are seen.
+    The file is streamed, so only one element array is held in memory at a
+    time. A read or parse failure ends the stream and is recorded in
+    load_errors.
+    """
     try:
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-    except Exception as e:
-        return [f"Failed to load JSON: {e}"]
+        with open(filepath, 'rb') as f:
+            builder = kind = None
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if event == 'end_array' and prefix == f"process.elements.{kind}":
+                        yield kind, builder.value
+                        builder = None
+                elif event == 'map_key':
+                    if prefix == '':
+                        keys.add(value)
+                    elif prefix == 'process':
+                        keys.add(f"process.{value}")
+                    elif prefix == 'process.elements':
+                        kind = value
+                elif event == 'start_array' and prefix == f"process.elements.{kind}":
+                    builder = ObjectBuilder()
+                    builder.event(event, value)
+    except (OSError, ValueError, ijson.JSONError) as e:
+        load_errors.append(f"Failed to load JSON: {e}")
+
+def check_bpmn_file(filepath, validate=None):
+    """Check basic BPMN file structure, then validate structurally sound
+    files with a compiled schema validator when one is given"""
+    keys = set()
+    load_errors = []
     
-    # Check basic structure
-    if 'process' not in data:
-        errors.append("Missing 'process' root element")
-        return errors
+    # Errors are grouped by kind and reported in REQUIRED_FIELDS order,
+    # whatever order the element arrays appear in within the file
+    kind_errors = {kind: [] for kind in REQUIRED_FIELDS}
     
-    process = data['process']
+    # Collect all element IDs; sequence flows are checked once every
+    # element has been seen, since they may come first in the file
+    all_ids = set()
+    flows = []
     
-    # Check required process fields
-    if 'id' not in process:
-        errors.append("Process missing 'id' field")
-    if 'name' not in process:
-        errors.append("Process missing 'name' field")
-    if 'elements' not in process:
-        errors.append("Process missing 'elements' field")
+    if ijson is not None and validate is None:
+        elements = _stream_elements(filepath, keys, load_errors)
     else:
-        elements = process['elements']
-        
-        # Collect all element IDs
-        all_ids = set()
-        
-        # Check events
-        if 'events' in elements:
-            for event in elements['events']:
-                if 'id' not in event:
-                    errors.append(f"Event missing 'id': {event}")
-                else:
-                    all_ids.add(event['id'])
-                if 'type' not in event:
-                    errors.append(f"Event {event.get('id', '?')} missing 'type'")
-                
-                # Check boundary events
-                if event.get('type') == 'boundaryEvent':
-                    if 'attachedToRef' not in event:
-                        errors.append(f"Boundary event {event.get('id', '?')} missing 'attachedToRef'")
-        
-        # Check activities
-        if 'activities' in elements:
-            for activity in elements['activities']:
-                if 'id' not in activity:
-                    errors.append(f"Activity missing 'id': {activity}")
-                else:
-                    all_ids.add(activity['id'])
-                if 'name' not in activity:
-                    errors.append(f"Activity {activity.get('id', '?')} missing 'name'")
-                if 'type' not in activity:
-                    errors.append(f"Activity {activity.get('id', '?')} missing 'type'")
-                
-                # Check agent assignment
-                if 'agent' in activity:
-                    agent = activity['agent']
-                    if 'type' not in agent:
-                        errors.append(f"Activity {activity.get('id', '?')} agent missing 'type'")
-                    if 'strategy' not in agent:
-                        errors.append(f"Activity {activity.get('id', '?')} agent missing 'strategy'")
+        # The schema validator needs the whole document, so parse it once
+        # and run the structural checks on the same object
+        try:
+            data = load_json(filepath)
+        except Exception as e:
+            return [f"Failed to load JSON: {e}"]
+        elements = _document_elements(data, keys)
+    
+    for kind, items in elements:
+        if kind == 'sequenceFlows':
+            flows.extend(items)
+            continue
+        if kind not in REQUIRED_FIELDS:
+            continue
         
-        # Check gateways
-        if 'gateways' in elements:
-            for gateway in elements['gateways']:
-                if 'id' not in gateway:
-                    errors.append(f"Gateway missing 'id': {gateway}")
-                else:
-                    all_ids.add(gateway['id'])
-                if 'type' not in gateway:
-                    errors.append(f"Gateway {gateway.get('id', '?')} missing 'type'")
+        all_ids |= {item['id'] for item in items if 'id' in item}
         
-        # Check sequence flows
-        if 'sequenceFlows' in elements:
-            for flow in elements['sequenceFlows']:
-                if 'id' not in flow:
-                    errors.append(f"Sequence flow missing 'id': {flow}")
-                if 'sourceRef' not in flow:
-                    errors.append(f"Sequence flow {flow.get('id', '?')} missing 'sourceRef'")
-                elif flow['sourceRef'] not in all_ids:
-                    errors.append(f"Sequence flow {flow.get('id', '?')} has invalid sourceRef: {flow['sourceRef']}")
-                if 'targetRef' not in flow:
-                    errors.append(f"Sequence flow {flow.get('id', '?')} missing 'targetRef'")
-                elif flow['targetRef'] not in all_ids:
-                    errors.append(f"Sequence flow {flow.get('id', '?')} has invalid targetRef: {flow['targetRef']}")
+        errors = kind_errors[kind]
+        for item in items:
+            errors.extend(_missing_fields(kind, item))
+            
+            # Check boundary events
+            if kind == 'events':
+                if item.get('type') == 'boundaryEvent' and 'attachedToRef' not in item:
+                    errors.append(f"Boundary event {item.get('id', '?')} missing 'attachedToRef'")
+            
+            # Check agent assignment
+            elif kind == 'activities' and 'agent' in item:
+                agent = item['agent']
+                if 'type' not in agent:
+                    errors.append(f"Activity {item.get('id', '?')} agent missing 'type'")
+                if 'strategy' not in agent:
+                    errors.append(f"Activity {item.get('id', '?')} agent missing 'strategy'")
     
+    if load_errors:
+        return load_errors
+    
+    # Check basic structure
+    if 'process' not in keys:
+        return ["Missing 'process' root element"]
+    
+    # Check required process fields
+    process_errors = []
+    if 'process.id' not in keys:
+        process_errors.append("Process missing 'id' field")
+    if 'process.name' not in keys:
+        process_errors.append("Process missing 'name' field")
+    if 'process.elements' not in keys:
+        process_errors.append("Process missing 'elements' field")
+    
+    # Check sequence flows
+    errors = kind_errors['sequenceFlows']
+    for flow in flows:
+        errors.extend(_missing_fields('sequenceFlows', flow))
+        errors.extend(
+            f"Sequence flow {flow.get('id', '?')} has invalid {ref}: {flow[ref]}"
+            for ref in ('sourceRef', 'targetRef')
+            if ref in flow and flow[ref] not in all_ids
+        )
+    
+    errors = process_errors + [
+        error for kind in REQUIRED_FIELDS for error in kind_errors[kind]
+    ]
+    
+    if not errors and validate is not None:
+        try:
+            validate(data)
+        except fastjsonschema.JsonSchemaException as e:
+            return [f"Schema validation failed: {e}"]
     return errors
 
-def main():
-    test_files = [
-        "test-data/simple-process.json",
-        "test-data/parallel-gateway.json",
-        "test-data/exclusive-gateway.json",
-        "test-data/subprocess.json",
-        "test-data/ai-human-collab.json",
-        "test-data/dynamic-assignment.json",
-        "test-data/invalid-bpmn.json"
-    ]
+def compile_schema(schema):
+    """Compile a JSON schema into a reusable validation function"""
+    return fastjsonschema.compile(schema)
+
+def _load_validator():
+    """Compile the combined schema, or explain why schema validation is
+    skipped and return None"""
+    if fastjsonschema is None:
+        print("fastjsonschema not installed, skipping schema validation")
+        return None
     
+    try:
+        schema = load_json(COMBINED_SCHEMA)
+        # Compare contents rather than timestamps, which a checkout resets
+        if schema != build_combined_schema(SCHEMA_FILES):
+            print(f"{COMBINED_SCHEMA} is out of date with its source schemas, "
+                  "skipping schema validation (run scripts/test-bpmn-combined.py)")
+            return None
+        return compile_schema(schema)
+    except (OSError, ValueError, fastjsonschema.JsonSchemaException) as e:
+        print(f"Could not load {COMBINED_SCHEMA}, skipping schema validation: {e}")
+        return None
+
+def main():
     print("BPMN JSON Structure Validation")
     print("=" * 50)
     
-    for filepath in test_files:
+    # Compile the schema once and reuse it for every file
+    validate = _load_validator()
+    
+    for filepath in TEST_FILES:
         print(f"\nTesting {filepath}...")
-        errors = check_bpmn_file(filepath)
+        errors = check_bpmn_file(filepath, validate)
         
         if not errors:
             print(f"✓ {filepath} - VALID")